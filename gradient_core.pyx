@@ -0,0 +1,52 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled version of the linear infill gradient kernel from orca_addGradientInfill.py.
+
+Build in place with:
+    cythonize -3 --inplace gradient_core.pyx
+
+The script falls back to the Numba or NumPy implementation when this extension is not built.
+"""
+
+import numpy as np
+from libc.math cimport sqrt
+
+cpdef object compute_line(
+    const double[::1] x1, const double[::1] y1, const double[::1] x2, const double[::1] y2, Py_ssize_t n,
+    double lx, double ly, double dx, double dy, Py_ssize_t steps,
+    double extrusion, double gradient_thickness, double max_ratio, double min_ratio, double feedrate,
+):
+    """Discretize an infill line into 'steps' sub-segments and return their (x, y, E, F) rows."""
+    out = np.empty((steps, 4))
+    cdef double[:, ::1] rows = out
+    cdef double slope = (min_ratio - max_ratio) / gradient_thickness
+    cdef double ex, ey, mx, my, px, py, norm, u, ddx, ddy, d2, best, d, ratio
+    cdef Py_ssize_t i, j
+    for i in range(steps):
+        ex = lx + dx
+        ey = ly + dy
+        mx = (lx + ex) * 0.5
+        my = (ly + ey) * 0.5
+        best = 1e300
+        for j in range(n):
+            px = x2[j] - x1[j]
+            py = y2[j] - y1[j]
+            norm = px * px + py * py + 1e-30
+            u = ((mx - x1[j]) * px + (my - y1[j]) * py) / norm
+            u = (u if u > 0.0 else 0.0) - (u - 1.0 if u > 1.0 else 0.0)
+            ddx = x1[j] + u * px - mx
+            ddy = y1[j] + u * py - my
+            d2 = ddx * ddx + ddy * ddy
+            if d2 < best:
+                best = d2
+                if best == 0.0:
+                    break  # the midpoint lies on a wall, no segment can be closer
+        d = sqrt(best)
+        ratio = min_ratio if d >= gradient_thickness else max_ratio + slope * d
+        rows[i, 0] = ex
+        rows[i, 1] = ey
+        rows[i, 2] = extrusion * ratio
+        rows[i, 3] = feedrate / ratio
+        lx = ex
+        ly = ey
+    return out
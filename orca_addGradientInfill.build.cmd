@@ -29,6 +29,7 @@ if %errorlevel% neq 0 (
 :: Embed Python script in CMD and execute it
 echo. > %TEMP%\check_imports_temp.py
 echo import importlib > %TEMP%\check_imports_temp.py
+echo import os >> %TEMP%\check_imports_temp.py
 echo import subprocess >> %TEMP%\check_imports_temp.py
 echo import sys >> %TEMP%\check_imports_temp.py
 echo missing_modules = [] >> %TEMP%\check_imports_temp.py
@@ -38,6 +39,9 @@ echo imports = [line.strip() for line in lines if line.strip().startswith("impor
 echo for imp in imports: >> %TEMP%\check_imports_temp.py
 echo.    module_name = imp.split()[1] >> %TEMP%\check_imports_temp.py
 echo.    if "." in module_name: module_name = module_name.split('.')[0] >> %TEMP%\check_imports_temp.py
+echo.    if os.path.exists(module_name + ".pyx"): continue >> %TEMP%\check_imports_temp.py
+:: Numba is optional and kept out of the executable, which cannot cache its compiled code between runs
+echo.    if module_name == "numba": continue >> %TEMP%\check_imports_temp.py
 echo.    try: >> %TEMP%\check_imports_temp.py
 echo.        importlib.import_module(module_name) >> %TEMP%\check_imports_temp.py
 echo.        print(f"Module '{module_name}' is already installed.") >> %TEMP%\check_imports_temp.py
@@ -66,8 +70,15 @@ if %errorlevel% neq 0 (
     exit /b %errorlevel%
 )
 
+echo Compiling the optional Cython gradient kernel...
+pip install cython
+cythonize -3 --inplace gradient_core.pyx
+if %errorlevel% neq 0 (
+    echo Cython build failed, the executable will use the Python gradient kernel.
+)
+
 echo Running PyInstaller to generate the executable...
-pyinstaller --name=%SCRIPT_NAME% --onefile --noconfirm --clean %SCRIPT_NAME%.py
+pyinstaller --name=%SCRIPT_NAME% --onefile --noconfirm --clean --exclude-module numba %SCRIPT_NAME%.py
 if %errorlevel% neq 0 (
     echo An error occurred during the build process. Exiting...
     exit /b %errorlevel%
@@ -7,9 +7,23 @@ import datetime
 import configparser
 from collections import namedtuple
 from enum import Enum
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional, Callable, Iterable, Iterator, TextIO
 import traceback
 import time
+import shutil
+import tempfile
+import itertools
+import functools
+import io
+import math
+from multiprocessing import Pool, freeze_support
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 __version__ = '2.0'
 
@@ -34,8 +48,8 @@ class InfillType(Enum):
     SMALL_SEGMENTS = 1  # Infill with small segments like gyroid or honeycomb
     LINEAR = 2          # Linear infill like rectilinear or triangles
 
-Point2D = namedtuple('Point2D', 'x y')
-Segment = namedtuple('Segment', 'point1 point2')
+# Plain tuples index faster than namedtuples and cost nothing to build in the hot loop
+Point2D = Tuple[float, float]  # (x, y)
 
 # Determine the application path (directory where the script or executable is located)
 if getattr(sys, 'frozen', False):
@@ -61,88 +75,323 @@ class Section(Enum):
     INNER_WALL = 1
     INFILL = 2
 
-def dist(segment: Segment, point: Point2D) -> float:
-    """Calculate the distance from a point to a line with finite length."""
-    px = segment.point2.x - segment.point1.x
-    py = segment.point2.y - segment.point1.y
-    norm = px * px + py * py
-    try:
-        u = ((point.x - segment.point1.x) * px + (point.y - segment.point1.y) * py) / float(norm)
-    except ZeroDivisionError:
-        return 0
+# Parser state that carries over from one layer to the next
+LayerState = namedtuple('LayerState', 'section last_position relative_extrusion_set g1_feedrate')
+INITIAL_LAYER_STATE = LayerState(Section.NOTHING, (-10000.0, -10000.0), False, 0)
 
-    u = max(min(u, 1), 0)
-    x = segment.point1.x + u * px
-    y = segment.point1.y + u * py
-    dx = x - point.x
-    dy = y - point.y
+# Section started by each ';TYPE:' name; any other type ends the current section
+SECTION_TYPES = {
+    "Inner wall": Section.INNER_WALL,
+    "Outer wall": Section.NOTHING,
+    "Solid infill": Section.NOTHING,
+    "Skin": Section.NOTHING,
+    "Sparse infill": Section.INFILL,
+    "Infill": Section.INFILL,
+}
 
-    return (dx * dx + dy * dy) ** 0.5
+# Statistics returned for each processed run of lines
+LayerStats = namedtuple('LayerStats', 'total_lines edits g2_g3_lines relative_extrusion')
 
-def get_points_distance(point1: Point2D, point2: Point2D) -> float:
-    """Calculate the Euclidean distance between two points."""
-    return ((point1.x - point2.x) ** 2 + (point1.y - point2.y) ** 2) ** 0.5
+# Comment prefixes that change the parser state, matched by a single startswith call
+# so that the many other comment lines are rejected in one pass
+STATE_MARKERS = (";TYPE:", ";LAYER_CHANGE", ";LAYER:")
 
-def min_distance_from_segment(segment: Segment, segments: List[Segment]) -> float:
-    """Calculate the minimum distance from the midpoint of 'segment' to the nearest segment in 'segments'."""
-    middlePoint = Point2D((segment.point1.x + segment.point2.x) / 2, (segment.point1.y + segment.point2.y) / 2)
-    return min(dist(s, middlePoint) for s in segments) if segments else float('inf')
+# Number of lines at the start and bytes at the end of the file searched for the infill pattern setting
+INFILL_TYPE_HEAD_LINES = 2000
+INFILL_TYPE_TAIL_BYTES = 512 * 1024
 
-# Pre-compile regex patterns
-prog_searchX = re.compile(r"X(-?\d*\.?\d*)")
-prog_searchY = re.compile(r"Y(-?\d*\.?\d*)")
+# Fixed-decimal formats for generated G1 commands and the E/F words of rewritten lines
+EXTRUSION_COMMAND_FORMAT = "G1 X%.3f Y%.3f E%.5f F%.3f\n"
+EXTRUSION_COMMAND_NO_FEEDRATE_FORMAT = "G1 X%.3f Y%.3f E%.5f\n"
+EXTRUSION_FORMAT = "E%.5f"
+FEEDRATE_FORMAT = "F%.3f"
 
-def getXY(currentLine: str) -> Point2D:
-    """Create a 'Point2D' object from a G-code line."""
-    searchX = prog_searchX.search(currentLine)
-    searchY = prog_searchY.search(currentLine)
+# Buffer size for reading and writing G-code, so streaming line by line rarely reaches the OS
+IO_BUFFER_SIZE = 1 << 20
 
-    if searchX and searchY:
-        elementX = searchX.group(1)
-        elementY = searchY.group(1)
+# Smaller files are streamed in a single pass without worker processes
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+
+# Layers handed to the worker pool at a time, which bounds the processed layers held in memory
+PARALLEL_BATCH_LAYERS = 256
+
+def get_points_distance(point1: Point2D, point2: Point2D) -> float:
+    """Calculate the Euclidean distance between two points."""
+    return ((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2) ** 0.5
+
+class PerimeterSegments:
+    """Perimeter segments stored as four parallel NumPy columns (x1, y1, x2, y2).
+
+    Segments are also bucketed into a uniform grid of 'cell_size' cells they pass through,
+    so every segment closer than 'cell_size' to a point is found in the 3x3 cells around it.
+    """
+
+    def __init__(self, cell_size: float, capacity: int = 1024):
+        self.x1 = np.empty(capacity)
+        self.y1 = np.empty(capacity)
+        self.x2 = np.empty(capacity)
+        self.y2 = np.empty(capacity)
+        self.count = 0
+        self.cell_size = cell_size
+        self.grid: Dict[Tuple[int, int], List[int]] = {}
+        self.indexed = 0
+
+    def append(self, x1: float, y1: float, x2: float, y2: float) -> None:
+        """Add the segment (x1, y1)-(x2, y2), doubling the backing arrays when they are full."""
+        n = self.count
+        if n == len(self.x1):
+            capacity = 2 * n
+            for name in ('x1', 'y1', 'x2', 'y2'):
+                grown = np.empty(capacity)
+                grown[:n] = getattr(self, name)
+                setattr(self, name, grown)
+        self.x1[n] = x1
+        self.y1[n] = y1
+        self.x2[n] = x2
+        self.y2[n] = y2
+        self.count = n + 1
+
+    def clear(self) -> None:
+        """Forget all segments while keeping the allocated arrays for reuse."""
+        self.count = 0
+        self.grid.clear()
+        self.indexed = 0
+
+    def _index_new_segments(self) -> None:
+        """Add the segments appended since the last lookup to every grid cell they pass through."""
+        start, end = self.indexed, self.count
+        cell = self.cell_size
+        scale = 1.0 / cell
+        grid = self.grid
+        columns = zip(
+            self.x1[start:end].tolist(), self.y1[start:end].tolist(),
+            self.x2[start:end].tolist(), self.y2[start:end].tolist(),
+        )
+        for i, (x1, y1, x2, y2) in enumerate(columns, start):
+            if x1 > x2:
+                x1, y1, x2, y2 = x2, y2, x1, y1
+            firstColumn = math.floor(x1 * scale)
+            lastColumn = math.floor(x2 * scale)
+            slope = (y2 - y1) / (x2 - x1) if lastColumn != firstColumn else 0.0
+            # Walk the columns the segment spans and only take the rows it crosses in each of them,
+            # so a long diagonal wall does not fill its whole bounding box
+            for ix in range(firstColumn, lastColumn + 1):
+                left = max(x1, ix * cell)
+                right = min(x2, (ix + 1) * cell)
+                yLeft = y1 + (left - x1) * slope if ix != firstColumn else y1
+                yRight = y1 + (right - x1) * slope if ix != lastColumn else y2
+                for iy in range(math.floor(min(yLeft, yRight) * scale), math.floor(max(yLeft, yRight) * scale) + 1):
+                    grid.setdefault((ix, iy), []).append(i)
+        self.indexed = end
+
+    def near(self, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Return the (x1, y1, x2, y2) columns of the segments in the cells around the given points."""
+        if self.indexed != self.count:
+            self._index_new_segments()
+        scale = 1.0 / self.cell_size
+        cells = set(zip(np.floor(xs * scale).astype(np.int64).tolist(), np.floor(ys * scale).astype(np.int64).tolist()))
+        found = set()
+        grid = self.grid
+        for ix, iy in cells:
+            for nx in (ix - 1, ix, ix + 1):
+                for ny in (iy - 1, iy, iy + 1):
+                    bucket = grid.get((nx, ny))
+                    if bucket:
+                        found.update(bucket)
+        index = np.fromiter(found, dtype=np.intp, count=len(found))
+        return self.x1[index], self.y1[index], self.x2[index], self.y2[index]
+
+def min_dist_vec(x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray, mx: float, my: float) -> float:
+    """Calculate the minimum distance from the point (mx, my) to the segments given as coordinate columns."""
+    if len(x1) == 0:
+        return float('inf')
+    px = x2 - x1
+    py = y2 - y1
+    norm = px * px + py * py
+    u = np.clip(((mx - x1) * px + (my - y1) * py) / np.where(norm == 0, 1, norm), 0, 1)
+    dx = x1 + u * px - mx
+    dy = y1 + u * py - my
+    return float(np.sqrt((dx * dx + dy * dy).min()))
+
+def min_distance_from_segment(mx: float, my: float, perimeter: PerimeterSegments) -> float:
+    """Calculate the minimum distance from the point (mx, my) to the nearest segment in 'perimeter'.
+
+    Only segments in the neighbouring grid cells are checked, so distances of at least one
+    cell size may be reported as infinity.
+    """
+    return min_dist_vec(*perimeter.near(np.array([mx]), np.array([my])), mx, my)
+
+def _gradient_segments_kernel(
+    x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray, n: int,
+    lx: float, ly: float, dx: float, dy: float, steps: int,
+    extrusion: float, gradient_thickness: float, max_ratio: float, min_ratio: float, feedrate: float,
+) -> np.ndarray:
+    """Discretize an infill line into 'steps' sub-segments and return their (x, y, E, F) rows."""
+    out = np.empty((steps, 4))
+    slope = (min_ratio - max_ratio) / gradient_thickness
+    for i in range(steps):
+        ex = lx + dx
+        ey = ly + dy
+        mx = (lx + ex) * 0.5
+        my = (ly + ey) * 0.5
+        best = 1e300  # finite sentinel, fastmath assumes no infinities
+        for j in range(n):
+            px = x2[j] - x1[j]
+            py = y2[j] - y1[j]
+            norm = px * px + py * py + 1e-30
+            u = ((mx - x1[j]) * px + (my - y1[j]) * py) / norm
+            u = max(u, 0.0) - max(u - 1.0, 0.0)
+            ddx = x1[j] + u * px - mx
+            ddy = y1[j] + u * py - my
+            d2 = ddx * ddx + ddy * ddy
+            if d2 < best:
+                best = d2
+                if best == 0.0:
+                    break  # the midpoint lies on a wall, no segment can be closer
+        d = best ** 0.5
+        ratio = min_ratio if d >= gradient_thickness else max_ratio + slope * d
+        out[i, 0] = ex
+        out[i, 1] = ey
+        out[i, 2] = extrusion * ratio
+        out[i, 3] = feedrate / ratio
+        lx = ex
+        ly = ey
+    return out
+
+def _gradient_segments_numpy(
+    x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray, n: int,
+    lx: float, ly: float, dx: float, dy: float, steps: int,
+    extrusion: float, gradient_thickness: float, max_ratio: float, min_ratio: float, feedrate: float,
+) -> np.ndarray:
+    """NumPy fallback for '_gradient_segments_kernel' evaluating all sub-segments against all segments at once."""
+    out = np.empty((steps, 4))
+    k = np.arange(1, steps + 1)
+    ex = lx + k * dx
+    ey = ly + k * dy
+    if n:
+        # (steps, n) distance matrix between the sub-segment midpoints and the perimeter segments
+        mx = (ex - 0.5 * dx)[:, None]
+        my = (ey - 0.5 * dy)[:, None]
+        x1 = x1[:n]
+        y1 = y1[:n]
+        px = x2[:n] - x1
+        py = y2[:n] - y1
+        norm = px * px + py * py
+        norm[norm == 0] = 1
+        u = np.clip(((mx - x1) * px + (my - y1) * py) / norm, 0, 1)
+        ddx = x1 + u * px - mx
+        ddy = y1 + u * py - my
+        shortest = np.sqrt((ddx * ddx + ddy * ddy).min(axis=1))
+    else:
+        shortest = np.full(steps, gradient_thickness)
+    ratio = max_ratio + np.minimum(shortest, gradient_thickness) * ((min_ratio - max_ratio) / gradient_thickness)
+    out[:, 0] = ex
+    out[:, 1] = ey
+    out[:, 2] = extrusion * ratio
+    out[:, 3] = feedrate / ratio
+    return out
+
+try:
+    # Optional Cython build of the same kernel (see gradient_core.pyx)
+    from gradient_core import compute_line as _compute_gradient_segments
+except ImportError:
+    if njit is not None:
+        # Compiled on first call and cached next to the script, so only the first run after a change pays the
+        # JIT warmup of about a second; a frozen executable could not cache it, so the build leaves Numba out
+        _compute_gradient_segments = njit(
+            cache=not getattr(sys, 'frozen', False), fastmath=True, boundscheck=False
+        )(_gradient_segments_kernel)
     else:
-        raise SyntaxError(f'G-code file parsing error for line: {currentLine}')
+        _compute_gradient_segments = _gradient_segments_numpy
+
+def parse_xyef(
+    currentLine: str,
+) -> Tuple[List[str], Optional[float], Optional[float], Optional[float], Optional[float]]:
+    """Split a G-code line once and return its tokens with the X, Y, E and F values (None if absent)."""
+    x = y = e = f = None
+    splitLine = currentLine.split()
+    for token in splitLine:
+        head = token[0]
+        if head == "X":
+            x = float(token[1:])
+        elif head == "Y":
+            y = float(token[1:])
+        elif head == "E":
+            e = float(token[1:])
+        elif head == "F":
+            f = float(token[1:])
+        elif head == ";":
+            break
+    return splitLine, x, y, e, f
+
+def parse_move(
+    currentLine: str,
+) -> Tuple[bool, Optional[List[str]], Optional[float], Optional[float], Optional[float], Optional[float]]:
+    """Parse a 'G' line into (isG1, tokens, x, y, e, f); lines other than G0/G1 moves give no values."""
+    if not currentLine.startswith(("G1 ", "G0 ")):
+        return False, None, None, None, None, None
+    return (currentLine[1] == "1",) + parse_xyef(currentLine)
+
+@functools.lru_cache(maxsize=None)
+def make_extrusion_ratio(max_flow: float, min_flow: float, gradient_thickness: float) -> Callable[[float], float]:
+    """Build the distance to extrusion ratio map with the flow ratios and slope computed once."""
+    max_ratio = max_flow * 0.01
+    min_ratio = min_flow * 0.01
+    slope = (min_ratio - max_ratio) / gradient_thickness
 
-    return Point2D(float(elementX), float(elementY))
+    def extrusion_ratio(d: float) -> float:
+        return min_ratio if d >= gradient_thickness else max_ratio + slope * d
 
-def mapRange(a: Tuple[float, float], b: Tuple[float, float], s: float) -> float:
-    """Calculate a multiplier for the extrusion value from the distance to the perimeter."""
-    (a1, a2), (b1, b2) = a, b
-    if a2 - a1 == 0:
-        return b1  # Avoid division by zero
-    return b1 + ((s - a1) * (b2 - b1) / (a2 - a1))
+    return extrusion_ratio
 
 def get_extrusion_command(x: float, y: float, extrusion: float, feedrate: float) -> str:
     """Format a G-code string from the X, Y coordinates and extrusion value."""
     if feedrate>0:
-        return "G1 X{} Y{} E{} F{}\n".format(round(x, 3), round(y, 3), round(extrusion, 5), round(feedrate, 3))
+        return EXTRUSION_COMMAND_FORMAT % (x, y, extrusion, feedrate)
     else:
-        return "G1 X{} Y{} E{}\n".format(round(x, 3), round(y, 3), round(extrusion, 5))
+        return EXTRUSION_COMMAND_NO_FEEDRATE_FORMAT % (x, y, extrusion)
+
+def get_scaled_extrusion_command(splitLine: List[str], extrusion_ratio: float, feedrate: float) -> str:
+    """Rebuild a tokenized G1 line with its E value scaled by 'extrusion_ratio' and 'feedrate' added if it has no F."""
+    parts = []
+    comment = []
+    feedrate_set = False
+    for index, element in enumerate(splitLine):
+        head = element[0]
+        if head == "E":
+            parts.append(EXTRUSION_FORMAT % (float(element[1:]) * extrusion_ratio))
+        elif head == ";":
+            comment = splitLine[index:]
+            break
+        else:
+            if head == "F":
+                feedrate_set = True
+            parts.append(element)
+    if not feedrate_set:
+        parts.append(FEEDRATE_FORMAT % feedrate)
+    return " ".join(parts + comment) + "\n"
 
 def is_begin_layer_line(line: str) -> bool:
     """Check if current line is the start of a layer section."""
-    return line.startswith(";LAYER_CHANGE") or line.startswith(";LAYER:")
-
-def is_begin_inner_wall_line(line: str) -> bool:
-    """Check if current line is the start of an inner wall section."""
-    return line.startswith(";TYPE:Inner wall")
-
-def is_end_inner_wall_line(line: str) -> bool:
-    """Check if current line is the start of an outer wall section."""
-    return line.startswith(";TYPE:Outer wall") or line.startswith(";TYPE:Solid infill") or line.startswith(";TYPE:Skin")
-
-def is_extrusion_line(line: str) -> bool:
-    """Check if current line is a standard printing segment."""
-    return "G1" in line and " X" in line and "Y" in line and "E" in line
-
-def is_begin_infill_segment_line(line: str) -> bool:
-    """Check if current line is the start of an infill."""
-    return line.startswith(";TYPE:Sparse infill") or line.startswith(";TYPE:Infill")
-
-def extract_infill_type(gcode_lines: List[str]) -> InfillType:
-    """Extract the infill type from the G-code file."""
+    return line.startswith((";LAYER_CHANGE", ";LAYER:"))
+
+def head_and_tail(gcode_file_path: str) -> Iterator[str]:
+    """Yield the first lines of the G-code file and then, only if still iterated, the lines at its end."""
+    with open(gcode_file_path, "r", encoding="utf-8", errors="surrogateescape") as gcodeFile:
+        yield from itertools.islice(gcodeFile, INFILL_TYPE_HEAD_LINES)
+    # Seek to the end instead of reading through the whole print to get there
+    with open(gcode_file_path, "rb") as gcodeFile:
+        size = gcodeFile.seek(0, os.SEEK_END)
+        gcodeFile.seek(max(0, size - INFILL_TYPE_TAIL_BYTES))
+        tail = gcodeFile.read().decode("utf-8", "surrogateescape")
+    # The first line may have been cut, and a small file's first lines were already yielded above
+    yield from tail.splitlines(keepends=True)[1:]
+
+def extract_infill_type(gcode_lines: Iterable[str]) -> InfillType:
+    """Extract the infill type from the G-code lines, stopping at the first match."""
     sparse_infill_pattern = None
     sparse_infill_pattern_pattern = re.compile(r"^; sparse_infill_pattern = (.+)")
+    # The setting lives in the slicer's header or config block, so callers pass only the ends of the file
     for line in gcode_lines:
         match = sparse_infill_pattern_pattern.match(line)
         if match:
@@ -197,212 +446,311 @@ def read_config(config_file_path: str) -> Dict[str, float]:
     }
     return params
 
-def reduce_by_percentage(value, percentage):
-    return value / (percentage / 100)
-
-def process_gcode_file(
-    gcode_file_path: str,
+def get_section(line: str) -> Section:
+    """Get the section started by a ';TYPE:' line."""
+    return SECTION_TYPES.get(line[len(";TYPE:"):].rstrip(), Section.NOTHING)
+
+def find_layer_states(gcode_file_path: str) -> List[Tuple[int, LayerState]]:
+    """Find the byte offset of every layer and the parser state carried into it from the previous layers."""
+    layerStates = [(0, INITIAL_LAYER_STATE)]
+    currentSection, lastPosition, relative_extrusion_set, g1_feedrate = INITIAL_LAYER_STATE
+    stateMarkers = tuple(marker.encode() for marker in STATE_MARKERS)
+    offset = 0
+
+    # Read as bytes so the offsets can be seeked to; only the lines that change the state are decoded
+    with open(gcode_file_path, "rb", buffering=IO_BUFFER_SIZE) as gcodeFile:
+        for rawLine in gcodeFile:
+            lineOffset = offset
+            offset += len(rawLine)
+            firstChar = rawLine[:1]
+            if firstChar == b"G":
+                # Same move and feedrate rules as process_layer, so both passes agree on the state
+                isG1, _, x, y, _, lineFeedrate = parse_move(rawLine.decode("utf-8", "surrogateescape"))
+                if x is not None and y is not None:
+                    lastPosition = (x, y)
+                if currentSection == Section.INFILL and isG1 and lineFeedrate is not None:
+                    g1_feedrate = lineFeedrate
+
+            elif firstChar == b"M":
+                if rawLine.startswith(b"M83"):
+                    relative_extrusion_set = True
+                elif rawLine.startswith(b"M82"):
+                    relative_extrusion_set = False
+
+            elif firstChar == b";" and rawLine.startswith(stateMarkers):
+                currentLine = rawLine.decode("utf-8", "surrogateescape")
+                if is_begin_layer_line(currentLine):
+                    layerStates.append((lineOffset, LayerState(currentSection, lastPosition, relative_extrusion_set, g1_feedrate)))
+                else:
+                    currentSection = get_section(currentLine)
+                    if currentSection == Section.INFILL:
+                        g1_feedrate = 0
+
+    return layerStates
+
+def process_layer(
+    gcode_lines: Iterable[str],
+    output: TextIO,
+    state: LayerState,
+    infill_type: InfillType,
     max_flow: float,
     min_flow: float,
     gradient_thickness: float,
     gradient_discretization: float,
-) -> Dict[str, Any]:
-    """Process the G-code file in place and modify infill portions with an extrusion width gradient."""
-    # Pre-compile regex patterns
-    prog_move = re.compile(r'^G[0-1].*X.*Y')
-    prog_extrusion = re.compile(r'^G1.*X.*Y.*E')
-    prog_type = re.compile(r'^;TYPE:')
-    prog_g2_g3 = re.compile(r'^G[2-3]')
-    prog_relative_extrusion = re.compile(r'^M83')
-    prog_absolute_extrusion = re.compile(r'^M82')
-    prog_g1_feedrate = re.compile(r'^G1.+F([\d\.]+)')
-
-    lines = []
+) -> LayerStats:
+    """Process a run of G-code lines starting from 'state' and write the result to 'output'."""
+    totalLines = 0
     edit = 0
-    stats = {'total_lines': 0, 'modifications_made': 0}
-    currentSection = Section.NOTHING
-    lastPosition = Point2D(-10000, -10000)
-    gradientDiscretizationLength = gradient_thickness / gradient_discretization
-    relative_extrusion = False
-    g2_g3_used = False
     g2_g3_lines = []
-    relative_extrusion_set = False
-    g1_feedrate = 0
-    perimeterSegments = []
-    infill_type = None  # Will be set after extracting from G-code
-
-    # Read all lines from the G-code file
-    with open(gcode_file_path, "r") as gcodeFile:
-        gcode_lines = gcodeFile.readlines()
-
-    stats['total_lines'] = len(gcode_lines)
-
-    # Extract infill type from G-code file
-    infill_type = extract_infill_type(gcode_lines)
-    if infill_type == InfillType.SMALL_SEGMENTS:
-        print("Detected infill type: SMALL_SEGMENTS")
-    else:
-        print("Detected infill type: LINEAR")
+    relative_extrusion_used = False
+    currentSection, lastPosition, relative_extrusion_set, g1_feedrate = state
+    gradientDiscretizationLength = gradient_thickness / gradient_discretization
+    perimeterSegments = PerimeterSegments(gradient_thickness)
+
+    # Flow settings and the infill type are loop invariant
+    max_ratio = max_flow * 0.01
+    min_ratio = min_flow * 0.01
+    gradient_ratio = make_extrusion_ratio(max_flow, min_flow, gradient_thickness)
+    max_feedrate_scale = 1.0 / max_ratio
+    linear_infill = infill_type == InfillType.LINEAR
+
+    # Bound methods and helpers used on every line are looked up once
+    write = output.write
+    parseMove = parse_move
+    appendPerimeter = perimeterSegments.append
+    innerWallSection = Section.INNER_WALL
+    infillSection = Section.INFILL
 
     for currentLine in gcode_lines:
-        writtenToFile = False
+        totalLines += 1
+
+        # Classify the line by its first character; only G-codes, M-codes and the comments that change
+        # the parser state are inspected, every other line is copied as is
+        firstChar = currentLine[:1]
+        if firstChar == ";":
+            if not currentLine.startswith(STATE_MARKERS):
+                write(currentLine)
+                continue
+        elif firstChar != "G" and firstChar != "M":
+            write(currentLine)
+            continue
+
+        # Parse every G0/G1 line once; the move, extrusion and feedrate checks below use these values
+        if firstChar == "G":
+            isG1, splitLine, x, y, extrusionLength, lineFeedrate = parseMove(currentLine)
+        else:
+            isG1 = False
+            x = y = extrusionLength = lineFeedrate = None
+        isMove = x is not None and y is not None
 
         #keep tack of extrusion mode
-        if prog_relative_extrusion.search(currentLine):
-            relative_extrusion_set = True
-        elif prog_absolute_extrusion.search(currentLine):
-            relative_extrusion_set = False
-
-
-
-        # Search if it indicates a type
-        if prog_type.search(currentLine):
-            if is_begin_inner_wall_line(currentLine):
-                currentSection = Section.INNER_WALL
-            elif is_end_inner_wall_line(currentLine):
-                currentSection = Section.NOTHING
-            elif is_begin_infill_segment_line(currentLine):
-                currentSection = Section.INFILL
-                g1_feedrate = 0
+        if firstChar == "M":
+            if currentLine.startswith("M83"):
+                relative_extrusion_set = True
+                relative_extrusion_used = True
+            elif currentLine.startswith("M82"):
+                relative_extrusion_set = False
+
+        elif firstChar == ";":
+            # Only the walls of the current layer are relevant for the gradient
+            if is_begin_layer_line(currentLine):
+                perimeterSegments.clear()
+
+            # Otherwise it indicates a type
             else:
-                currentSection = Section.NOTHING
+                currentSection = get_section(currentLine)
+                if currentSection is infillSection:
+                    g1_feedrate = 0
 
-        if currentSection == Section.INNER_WALL and is_extrusion_line(currentLine):
-            perimeterSegments.append(Segment(getXY(currentLine), lastPosition))
+        if currentSection is innerWallSection:
+            if isG1 and isMove and extrusionLength is not None:
+                appendPerimeter(x, y, lastPosition[0], lastPosition[1])
 
-        if currentSection == Section.INFILL:
+        elif currentSection is infillSection:
             # check extrusion mode
             if not relative_extrusion_set:
                 print("!!!ERROR!!! Please don't use relative extrusion on infill")
                 print("!!!ERROR!!! Please don't use relative extrusion on infill")
                 print("!!!ERROR!!! Please don't use relative extrusion on infill")
-                exit(1)
+                raise ValueError("Relative extrusion (M83) is required in the infill section")
 
 
             # Check for G2/G3 commands **only in the infill section**
-            if prog_g2_g3.search(currentLine):
-                g2_g3_used = True
+            if firstChar == "G" and currentLine.startswith(("G2 ", "G3 ")):
                 g2_g3_lines.append(currentLine.strip())
 
-            prog_g1_feedrate_match = prog_g1_feedrate.match(currentLine)
-            if prog_g1_feedrate_match:
-                g1_feedrate = float(prog_g1_feedrate_match.group(1))
-
-            if prog_extrusion.search(currentLine):
-                currentPosition = getXY(currentLine)
-                splitLine = currentLine.strip().split(" ")
+            if isG1 and lineFeedrate is not None:
+                g1_feedrate = lineFeedrate
 
-                if infill_type == InfillType.LINEAR:
-                    # Find extrusion length
-                    extrusionLength = None
-                    for element in splitLine:
-                        if "E" in element:
-                            extrusionLength = float(element[1:])
-                    if extrusionLength is None:
-                        raise ValueError(f"No extrusion length found in line: {currentLine}")
+            if isG1 and isMove and extrusionLength is not None:
+                currentPosition = (x, y)
 
+                if linear_infill:
                     segmentLength = get_points_distance(lastPosition, currentPosition)
                     if segmentLength == 0:
                         segmentSteps = 1
                     else:
                         segmentSteps = segmentLength / gradientDiscretizationLength
                     extrusionLengthPerSegment = extrusionLength / segmentSteps if segmentSteps != 0 else 0
-                    segmentDirection = Point2D(
-                        (currentPosition.x - lastPosition.x) / segmentSteps if segmentSteps != 0 else 0,
-                        (currentPosition.y - lastPosition.y) / segmentSteps if segmentSteps != 0 else 0,
-                    )
+                    lastX, lastY = lastPosition
+                    directionX = (x - lastX) / segmentSteps if segmentSteps != 0 else 0
+                    directionY = (y - lastY) / segmentSteps if segmentSteps != 0 else 0
                     if segmentSteps >= 2:
-                        for _ in range(int(segmentSteps)):
-                            segmentEnd = Point2D(
-                                lastPosition.x + segmentDirection.x, lastPosition.y + segmentDirection.y
-                            )
-                            shortestDistance = min_distance_from_segment(
-                                Segment(lastPosition, segmentEnd), perimeterSegments
-                            )
-                            extrusion_ratio = mapRange(
-                                (0, gradient_thickness), 
-                                (max_flow / 100, min_flow / 100), 
-                                min(shortestDistance, gradient_thickness)
-                            )
-                            segmentExtrusion = extrusionLengthPerSegment * extrusion_ratio
-                            feedrate = reduce_by_percentage(g1_feedrate, extrusion_ratio*100)
-
-                            lines.append(get_extrusion_command(segmentEnd.x, segmentEnd.y, segmentExtrusion, feedrate))
-                            lastPosition = segmentEnd
+                        steps = int(segmentSteps)
+                        offsets = np.arange(steps) + 0.5
+                        x1, y1, x2, y2 = perimeterSegments.near(lastX + offsets * directionX, lastY + offsets * directionY)
+                        subSegments = _compute_gradient_segments(
+                            x1, y1, x2, y2, len(x1),
+                            lastX, lastY, directionX, directionY,
+                            steps, extrusionLengthPerSegment, gradient_thickness,
+                            max_ratio, min_ratio, float(g1_feedrate),
+                        )
+                        # Merge runs of sub-segments with the same flow (the interior beyond the gradient band)
+                        # into one move ending at the last of them and carrying their summed extrusion;
+                        # both E and F are compared, since a zero extrusion leaves only F to tell the flow apart
+                        flowChanges = (np.diff(subSegments[:, 2:4], axis=0) != 0).any(axis=1)
+                        runEnds = np.flatnonzero(np.append(flowChanges, True))
+                        if len(runEnds) < steps:
+                            runExtrusion = np.cumsum(subSegments[:, 2])[runEnds]
+                            subSegments = subSegments[runEnds]
+                            subSegments[:, 2] = np.diff(runExtrusion, prepend=0.0)
+                        # Format the whole stroke in one pass and hand it to the output as a single string
+                        columns = subSegments.T.tolist()
+                        if g1_feedrate > 0:
+                            write("".join([EXTRUSION_COMMAND_FORMAT % row for row in zip(*columns)]))
+                        else:
+                            write("".join([EXTRUSION_COMMAND_NO_FEEDRATE_FORMAT % row for row in zip(*columns[:3])]))
+                        lastPosition = (columns[0][-1], columns[1][-1])
                         # Missing Segment
                         segmentLengthRatio = get_points_distance(lastPosition, currentPosition) / segmentLength if segmentLength != 0 else 0
-                        lines.append(
+                        write(
                             get_extrusion_command(
-                                currentPosition.x,
-                                currentPosition.y,
-                                segmentLengthRatio * extrusionLength * max_flow / 100,
-                                reduce_by_percentage(g1_feedrate, max_flow)
+                                x,
+                                y,
+                                segmentLengthRatio * extrusionLength * max_ratio,
+                                g1_feedrate * max_feedrate_scale
                             )
                         )
                     else:
-                        outPutLine = ""
-                        feedrate_set = False
-                        for element in splitLine:
-                            if "E" in element:
-                                outPutLine += "E" + str(round(float(element[1:]) * max_flow / 100, 5)) + " "
-                            else:
-                                outPutLine += element + " "
-                            if "F" in element:
-                                feedrate_set = True
-                        if not feedrate_set:
-                            outPutLine += f"F{reduce_by_percentage(g1_feedrate, max_flow)}" + " "
-                        outPutLine = outPutLine.strip() + "\n"
-                        lines.append(outPutLine)
-                    writtenToFile = True
-                    edit += 1
-
-                elif infill_type == InfillType.SMALL_SEGMENTS:
+                        write(
+                            get_scaled_extrusion_command(splitLine, max_ratio, g1_feedrate * max_feedrate_scale)
+                        )
+
+                else:
                     shortestDistance = min_distance_from_segment(
-                        Segment(lastPosition, currentPosition), perimeterSegments
+                        (lastPosition[0] + x) / 2, (lastPosition[1] + y) / 2, perimeterSegments
                     )
 
-                    outPutLine = ""
-                    feedrate_set = False
-                    for element in splitLine:
-                        if "E" in element:
-                            if shortestDistance < gradient_thickness:
-                                newE = float(element[1:]) * mapRange((0, gradient_thickness), (max_flow / 100, min_flow / 100), shortestDistance)
-                            else:
-                                newE = float(element[1:]) * min_flow / 100
-                            outPutLine += "E" + str(round(newE, 5)) + " "
-                        else:
-                            outPutLine += element + " "
-                        if "F" in element:
-                                feedrate_set = True
-                    if not feedrate_set:
-                        if shortestDistance < gradient_thickness:
-                            newF = g1_feedrate / mapRange((0, gradient_thickness), (max_flow / 100, min_flow / 100), shortestDistance)
-                        outPutLine += f"F{round(newF,3)}" + " "
-                    outPutLine = outPutLine.strip() + "\n"
-                    lines.append(outPutLine)
-                    writtenToFile = True
-                    edit += 1
+                    extrusion_ratio = gradient_ratio(shortestDistance)
+                    write(get_scaled_extrusion_command(splitLine, extrusion_ratio, g1_feedrate / extrusion_ratio))
 
+                edit += 1
                 lastPosition = currentPosition
+                continue
 
-            if prog_move.search(currentLine):
-                lastPosition = getXY(currentLine)
-                if not writtenToFile:
-                    lines.append(currentLine)
-                    writtenToFile = True
+        # Every other line is copied unchanged, only tracking the position of moves
+        if isMove:
+            lastPosition = (x, y)
+        write(currentLine)
 
-            if not writtenToFile:
-                lines.append(currentLine)
-                writtenToFile = True
+    return LayerStats(totalLines, edit, g2_g3_lines, relative_extrusion_used)
 
-        else:
-            # Update last position if move command
-            if prog_move.search(currentLine):
-                lastPosition = getXY(currentLine)
+def process_layer_text(
+    layer: Tuple[str, int, int, LayerState],
+    infill_type: InfillType,
+    max_flow: float,
+    min_flow: float,
+    gradient_thickness: float,
+    gradient_discretization: float,
+) -> Tuple[str, LayerStats]:
+    """Read one layer's bytes from the G-code file and process them into a string a worker process can send back."""
+    gcode_file_path, start, end, state = layer
+    with open(gcode_file_path, "rb") as gcodeFile:
+        gcodeFile.seek(start)
+        layerData = gcodeFile.read(end - start)
+    # Same decoding and newline handling as streaming the file in text mode
+    layerLines = io.TextIOWrapper(io.BytesIO(layerData), encoding="utf-8", errors="surrogateescape")
+    buf = io.StringIO()
+    layerStats = process_layer(
+        layerLines, buf, state, infill_type, max_flow, min_flow, gradient_thickness, gradient_discretization
+    )
+    return buf.getvalue(), layerStats
 
-            if not writtenToFile:
-                lines.append(currentLine)
-                writtenToFile = True
+def process_gcode_file(
+    gcode_file_path: str,
+    max_flow: float,
+    min_flow: float,
+    gradient_thickness: float,
+    gradient_discretization: float,
+) -> Dict[str, Any]:
+    """Process the G-code file in place and modify infill portions with an extrusion width gradient."""
+    edit = 0
+    stats = {'total_lines': 0, 'modifications_made': 0}
+    relative_extrusion = False
+    g2_g3_lines = []
+    infill_type = None  # Will be set after extracting from G-code
+    results = []
+
+    # Layers are independent once their entry state is known, so large files are split per layer and
+    # processed in parallel, each worker reading its own layers; smaller files are streamed in a single pass
+    workers = os.cpu_count() or 1
+    parallel = workers > 1 and os.path.getsize(gcode_file_path) >= PARALLEL_MIN_BYTES
+
+    # Extract infill type from G-code file
+    infill_type = extract_infill_type(head_and_tail(gcode_file_path))
+    if infill_type == InfillType.SMALL_SEGMENTS:
+        print("Detected infill type: SMALL_SEGMENTS")
+    else:
+        print("Detected infill type: LINEAR")
+
+    # Write to a temporary file next to the G-code and swap it in only once processing succeeded
+    outputFile = tempfile.NamedTemporaryFile(
+        "w", dir=os.path.dirname(os.path.abspath(gcode_file_path)), suffix=".tmp", delete=False,
+        buffering=IO_BUFFER_SIZE, encoding="utf-8", errors="surrogateescape",
+    )
+    try:
+        with outputFile:
+            # Write through the underlying file object; the tempfile wrapper adds a Python call per write
+            output = outputFile.file
+            if parallel:
+                layerStates = find_layer_states(gcode_file_path)
+                layerEnds = [start for start, _ in layerStates[1:]] + [os.path.getsize(gcode_file_path)]
+                layers = [
+                    (gcode_file_path, start, end, state) for (start, state), end in zip(layerStates, layerEnds)
+                ]
+                processLayer = functools.partial(
+                    process_layer_text,
+                    infill_type=infill_type, max_flow=max_flow, min_flow=min_flow,
+                    gradient_thickness=gradient_thickness, gradient_discretization=gradient_discretization,
+                )
+                with Pool(workers) as pool:
+                    # Pool.imap queues its whole input at once, so layers are submitted in bounded batches
+                    # to limit how many processed layers can wait in memory for an earlier one
+                    for batchStart in range(0, len(layers), PARALLEL_BATCH_LAYERS):
+                        batch = layers[batchStart:batchStart + PARALLEL_BATCH_LAYERS]
+                        for layerText, layerStats in pool.imap(
+                            processLayer, batch, chunksize=max(1, len(batch) // (4 * workers))
+                        ):
+                            output.write(layerText)
+                            results.append(layerStats)
+            else:
+                with open(gcode_file_path, "r", buffering=IO_BUFFER_SIZE, encoding="utf-8", errors="surrogateescape") as gcodeFile:
+                    results.append(process_layer(
+                        gcodeFile, output, INITIAL_LAYER_STATE, infill_type,
+                        max_flow, min_flow, gradient_thickness, gradient_discretization,
+                    ))
+        shutil.copymode(gcode_file_path, outputFile.name)
+        os.replace(outputFile.name, gcode_file_path)
+    except BaseException:
+        os.remove(outputFile.name)
+        raise
+
+    for layerStats in results:
+        stats['total_lines'] += layerStats.total_lines
+        edit += layerStats.edits
+        g2_g3_lines.extend(layerStats.g2_g3_lines)
+        relative_extrusion = relative_extrusion or layerStats.relative_extrusion
+    g2_g3_used = bool(g2_g3_lines)
 
     stats['modifications_made'] = edit
 
@@ -428,11 +776,6 @@ def process_gcode_file(
 
     stats['infill_type'] = infill_type.name
 
-    # Write the modified G-code back to the same file
-    with open(gcode_file_path, "w") as outputFile:
-        for line in lines:
-            outputFile.write("%s" % line)
-
     return stats
 
 
@@ -505,4 +848,5 @@ def main():
         sys.exit(1)
 
 if __name__ == '__main__':
+    freeze_support()
     main()